@@ -0,0 +1,71 @@
+import io
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from FXVault.middleware import list_profiles, profile_dir
+
+
+class Command(BaseCommand):
+    help = "List captured request profiles, or summarize one by id."
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help="Profile to summarize; omit to list all profiles.")
+        parser.add_argument('--limit', type=int, default=20, help="Number of rows to show.")
+        parser.add_argument('--sort', default='cumulative', help="pstats sort key for the function summary.")
+
+    def handle(self, *args, **options):
+        if options['profile_id']:
+            self.show_summary(options['profile_id'], options['limit'], options['sort'])
+        else:
+            self.show_list(options['limit'])
+
+    def show_list(self, limit):
+        profiles = list_profiles()
+        if not profiles:
+            self.stdout.write(f"No profiles found in {profile_dir()}")
+            return
+        self.stdout.write(f"{'ID':<32} {'METHOD':<7} {'STATUS':<6} {'TIME (s)':>9} {'PEAK (KiB)':>11} "
+                          f"{'QUERIES':>7}  PATH")
+        for profile in profiles[:limit]:
+            try:
+                row = (
+                    f"{profile['id']:<32} {profile['method']:<7} {profile['status']:<6} "
+                    f"{profile['duration']:>9.4f} {profile['peak_memory'] / 1024:>11.1f} "
+                    f"{len(profile['queries']):>7}  {profile['path']}"
+                )
+            except (KeyError, TypeError, ValueError):
+                self.stderr.write(f"Skipping malformed profile {profile.get('id', '<unknown>')}")
+                continue
+            self.stdout.write(row)
+
+    def show_summary(self, profile_id, limit, sort):
+        profile = next((p for p in list_profiles() if p.get('id') == profile_id), None)
+        if profile is None:
+            raise CommandError(f"Profile {profile_id} not found in {profile_dir()}")
+
+        # Load the call profile first so a missing file or bad sort key fails before any output
+        output = io.StringIO()
+        try:
+            stats = pstats.Stats(str(profile_dir() / f"{profile_id}.prof"), stream=output)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            raise CommandError(f"Call profile for {profile_id} could not be read: {e}")
+        try:
+            stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        except KeyError:
+            sort_keys = ', '.join(pstats.Stats.sort_arg_dict_default)
+            raise CommandError(f"Invalid sort key {sort!r}; use one of: {sort_keys}")
+
+        try:
+            queries = profile['queries']
+            self.stdout.write(f"{profile['method']} {profile['path']} -> {profile['status']} at {profile['created']}")
+            self.stdout.write(f"Total time: {profile['duration']:.4f} seconds")
+            self.stdout.write(f"Peak traced memory: {profile['peak_memory'] / 1024:.1f} KiB")
+            self.stdout.write(f"SQL queries: {len(queries)} taking {sum(q['duration'] for q in queries):.4f} seconds")
+            for query in sorted(queries, key=lambda q: q['duration'], reverse=True)[:limit]:
+                self.stdout.write(f"  {query['duration']:.4f}s [{query['alias']}] {query['sql']}")
+        except (KeyError, TypeError, ValueError) as e:
+            raise CommandError(f"Profile {profile_id} is malformed: missing or invalid {e}")
+
+        self.stdout.write("")
+        self.stdout.write(output.getvalue(), ending='')
@@ -0,0 +1,154 @@
+import cProfile
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('FXVault')
+
+PROFILE_HEADER = 'HTTP_X_FXVAULT_PROFILE'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# cProfile and tracemalloc are process-wide, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def profile_dir():
+    return Path(settings.PROFILE_DIR)
+
+
+def list_profiles():
+    """Return stored profile metadata, newest first."""
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            profile = json.loads(path.read_text())
+        except (OSError, ValueError):
+            logger.warning("Skipping unreadable profile %s", path)
+            continue
+        if not isinstance(profile, dict):
+            logger.warning("Skipping malformed profile %s", path)
+            continue
+        profiles.append(profile)
+    return profiles
+
+
+def rotate_profiles(max_files):
+    for path in sorted(profile_dir().glob('*.json'), reverse=True)[max_files:]:
+        path.unlink(missing_ok=True)
+        path.with_suffix('.prof').unlink(missing_ok=True)
+
+
+class QueryRecorder:
+    """Database execute wrapper collecting the SQL run during a profiled request."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "alias": context['connection'].alias,
+                "sql": sql,
+                "many": many,
+                "duration": time.perf_counter() - start,
+            })
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests that carry the X-FXVault-Profile header matching PROFILE_HEADER_TOKEN,
+    or a PROFILE_SAMPLE_RATE fraction of all requests. Each profile is written to PROFILE_DIR
+    as a pstats-loadable <id>.prof file plus an <id>.json summary of timings, the tracemalloc
+    peak and the SQL executed. Inspect them with `python manage.py profiles`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header_token = settings.PROFILE_HEADER_TOKEN
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE
+        self.max_files = settings.PROFILE_MAX_FILES
+        if not self.header_token and self.sample_rate <= 0:
+            raise MiddlewareNotUsed("Request profiling is disabled")
+
+    def __call__(self, request):
+        if not self.should_profile(request) or not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request)
+        finally:
+            _profile_lock.release()
+
+    def should_profile(self, request):
+        token = request.META.get(PROFILE_HEADER)
+        if token and self.header_token:
+            # compare_digest rejects non-ASCII str, and header values are client-controlled
+            return hmac.compare_digest(token.encode(), self.header_token.encode())
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profile(self, request):
+        recorder = QueryRecorder()
+        profiler = cProfile.Profile()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+        finally:
+            duration = time.perf_counter() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+
+        profile_id = self.save(request, response, profiler, recorder, duration, peak_memory)
+        if profile_id:
+            response[PROFILE_ID_HEADER] = profile_id
+        return response
+
+    def save(self, request, response, profiler, recorder, duration, peak_memory):
+        created = datetime.now(timezone.utc)
+        profile_id = f"{created:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        directory = profile_dir()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(directory / f"{profile_id}.prof")
+            (directory / f"{profile_id}.json").write_text(json.dumps({
+                "id": profile_id,
+                "created": created.isoformat(),
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration": duration,
+                "peak_memory": peak_memory,
+                "queries": recorder.queries,
+            }, indent=2))
+            rotate_profiles(self.max_files)
+        except OSError:
+            logger.exception("Failed to write request profile to %s", directory)
+            return None
+        logger.info("Profiled %s %s in %.4f seconds as %s", request.method, request.path, duration, profile_id)
+        return profile_id
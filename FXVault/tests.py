@@ -1,3 +1,526 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+import unittest
+import uuid
+from io import StringIO
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+from redis.exceptions import RedisError
+from rest_framework.test import APIClient
+
+from . import throttling
+from .middleware import ProfilingMiddleware, list_profiles
+from .models import Transaction, UserCurrencyPreference
+from .serializers import TransactionSerializer, ExchangeRateSerializer
+from .throttling import TokenBucketThrottle, UpstreamFetchThrottle, UserRequestRateThrottle
+from .views import build_transaction_serializer
+
+# Stored timings for the micro-benchmarks below. Wall-clock baselines only hold on comparable
+# hardware, so the benchmarks are opt-in:
+#   FXVAULT_BENCHMARKS=1 python manage.py test FXVault
+# Regenerate the baselines on a quiet machine with
+#   FXVAULT_UPDATE_PERF_BASELINES=1 python manage.py test FXVault
+RUN_BENCHMARKS = os.getenv('FXVAULT_BENCHMARKS') == '1' or os.getenv('FXVAULT_UPDATE_PERF_BASELINES') == '1'
+PERF_BASELINES_PATH = Path(__file__).resolve().parent / 'perf_baselines.json'
+PERF_TOLERANCE = float(os.getenv('FXVAULT_PERF_TOLERANCE', 3.0))
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fxvault-tests',
+    }
+}
+
+CONVERSION_RATES = {"USD": 1, "KES": 129.25, "EUR": 0.92, "GBP": 0.79}
+
+
+class StubRateProvider:
+    """Stand-in for the exchange rate API that counts every upstream call."""
+
+    def __init__(self, status_code=200, conversion_rates=None):
+        self.status_code = status_code
+        self.conversion_rates = CONVERSION_RATES if conversion_rates is None else conversion_rates
+        self.calls = []
+
+    def __call__(self, url, *args, **kwargs):
+        self.calls.append(url)
+        response = mock.Mock(status_code=self.status_code)
+        response.json.return_value = {
+            "conversion_rates": self.conversion_rates,
+            "rates": self.conversion_rates,
+        }
+        return response
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    EXCHANGE_RATE_API_URL='https://rates.test/v6',
+    EXCHANGE_RATE_API_KEY='test-key',
+)
+class EndpointBudgetTestCase(TestCase):
+    """Base class wiring an authenticated client to a counting stub provider."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='budget', password='password123')
+        UserCurrencyPreference.objects.create(user=self.user, allowed_currencies=['USD', 'KES', 'EUR'])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.provider = StubRateProvider()
+        for target in ('FXVault.views.requests.get', 'FXVault.serializers.requests.get'):
+            patcher = mock.patch(target, side_effect=self.provider)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Throttle checks go to Redis; stand in for the token bucket and let everything through
+        self.consume_patcher = mock.patch.object(TokenBucketThrottle, 'consume', autospec=True,
+                                                 return_value=(True, None))
+        self.consume = self.consume_patcher.start()
+        self.addCleanup(self.consume_patcher.stop)
+
+    def consumed(self, scope):
+        keys = [call.args[1] for call in self.consume.call_args_list]
+        return [key for key in keys if key.startswith(f"throttle_bucket_{scope}_")]
+
+    def create_transaction(self, output_currency='KES'):
+        return self.client.post(reverse('create_transaction'), {
+            "customer_id": "cust-1",
+            "input_amount": "100.00",
+            "input_currency": "USD",
+            "output_currency": output_currency,
+        }, format='json')
+
+    def make_transactions(self, count):
+        Transaction.objects.bulk_create([
+            Transaction(customer_id=f"cust-{i}", input_amount=Decimal('10.00'), input_currency='USD',
+                        output_amount=Decimal('1292.50'), output_currency='KES')
+            for i in range(count)
+        ])
+
+
+class QueryBudgetTests(EndpointBudgetTestCase):
+    """Exact query counts per endpoint; a change here should be deliberate."""
+
+    def test_create_cold_cache(self):
+        # preference lookup + transaction insert
+        with self.assertNumQueries(2):
+            response = self.create_transaction()
+        self.assertEqual(response.status_code, 201)
+
+    def test_create_warm_cache(self):
+        self.create_transaction()
+        with self.assertNumQueries(2):
+            response = self.create_transaction()
+        self.assertEqual(response.status_code, 201)
+
+    def test_list_does_not_grow_with_rows(self):
+        self.make_transactions(1)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('list_transactions'))
+        self.make_transactions(50)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('list_transactions'))
+        self.assertEqual(len(response.data['data']), 51)
+
+    def test_detail(self):
+        self.make_transactions(1)
+        identifier = Transaction.objects.get().identifier
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('detail_transaction', kwargs={'identifier': identifier}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_currencies(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('currency-list'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_preferences_update(self):
+        # preference lookup + update + user lookup for the serialized username
+        with self.assertNumQueries(3):
+            response = self.client.patch(reverse('user-preferences'), {"allowed_currencies": ['USD', 'GBP']},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_preferences_create_existing(self):
+        # get_or_create lookup + update + user lookup for the serialized username
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('user-preferences'), {"allowed_currencies": ['USD', 'EUR']},
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class UpstreamCallBudgetTests(EndpointBudgetTestCase):
+    """Upstream calls made against cold and warm caches."""
+
+    def test_create_cold_cache_fetches_once(self):
+        self.create_transaction()
+        self.assertEqual(len(self.provider.calls), 1)
+
+    def test_create_warm_cache_does_not_fetch(self):
+        self.create_transaction()
+        self.create_transaction()
+        self.create_transaction()
+        self.assertEqual(len(self.provider.calls), 1)
+
+    def test_create_fetches_once_per_pair(self):
+        self.create_transaction(output_currency='KES')
+        self.create_transaction(output_currency='EUR')
+        self.create_transaction(output_currency='KES')
+        self.assertEqual(len(self.provider.calls), 2)
+
+    def test_create_upstream_failure_is_not_cached(self):
+        self.provider.status_code = 503
+        self.assertEqual(self.create_transaction().status_code, 502)
+        self.assertEqual(self.create_transaction().status_code, 502)
+        self.assertEqual(len(self.provider.calls), 2)
+
+    def test_currencies_fetches_once_per_request(self):
+        self.client.get(reverse('currency-list'))
+        self.client.get(reverse('currency-list'))
+        self.assertEqual(len(self.provider.calls), 2)
+
+    def test_preferences_validation_fetches_once(self):
+        self.client.patch(reverse('user-preferences'), {"allowed_currencies": ['USD', 'GBP', 'EUR']},
+                          format='json')
+        self.assertEqual(len(self.provider.calls), 1)
+
+    def test_list_and_detail_do_not_fetch(self):
+        self.make_transactions(3)
+        self.client.get(reverse('list_transactions'))
+        identifier = Transaction.objects.first().identifier
+        self.client.get(reverse('detail_transaction', kwargs={'identifier': identifier}))
+        self.assertEqual(self.provider.calls, [])
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "Set FXVAULT_BENCHMARKS=1 to run the micro-benchmarks")
+class MicroBenchmarkTests(SimpleTestCase):
+    """
+    Best-of-N timings for the create path compared against perf_baselines.json.
+    A benchmark fails when it is slower than its baseline by more than PERF_TOLERANCE.
+    """
+    repeat = 5
+    number = 200
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.update_baselines = os.getenv('FXVAULT_UPDATE_PERF_BASELINES') == '1'
+        cls.baselines = json.loads(PERF_BASELINES_PATH.read_text()) if PERF_BASELINES_PATH.exists() else {}
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.update_baselines and cls.results:
+            cls.baselines.update(cls.results)
+            PERF_BASELINES_PATH.write_text(json.dumps(cls.baselines, indent=4, sort_keys=True) + '\n')
+        super().tearDownClass()
+
+    def measure(self, name, func):
+        func()  # warm up
+        best = float('inf')
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            for _ in range(self.number):
+                func()
+            best = min(best, (time.perf_counter() - start) / self.number)
+        self.results[name] = best
+
+        if self.update_baselines:
+            return
+        baseline = self.baselines.get(name)
+        if baseline is None:
+            self.skipTest(f"No stored baseline for {name}")
+        self.assertLessEqual(
+            best, baseline * PERF_TOLERANCE,
+            f"{name} regressed: {best * 1e6:.1f}us per call vs baseline {baseline * 1e6:.1f}us "
+            f"(tolerance x{PERF_TOLERANCE})"
+        )
+
+    def test_create_conversion(self):
+        exchange_rate = Decimal(str(CONVERSION_RATES['KES']))
+        request_data = {
+            "customer_id": "cust-1",
+            "input_amount": "1234.56",
+            "input_currency": "USD",
+            "output_currency": "KES",
+        }
+
+        def convert():
+            exchange_rate_serializer = ExchangeRateSerializer(data=request_data)
+            exchange_rate_serializer.is_valid(raise_exception=True)
+            return build_transaction_serializer(exchange_rate_serializer.validated_data, exchange_rate)
+
+        self.assertEqual(convert().initial_data['output_amount'], Decimal('159566.88'))
+        self.measure('create_conversion', convert)
+
+    def test_create_serialization(self):
+        exchange_rate = Decimal(str(CONVERSION_RATES['KES']))
+        validated_data = {
+            "customer_id": "cust-1",
+            "input_amount": Decimal('1234.56'),
+            "input_currency": "USD",
+            "output_currency": "KES",
+        }
+
+        def serialize():
+            transaction_serializer = build_transaction_serializer(validated_data, exchange_rate)
+            transaction_serializer.is_valid(raise_exception=True)
+            return transaction_serializer.data
+
+        self.measure('create_serialization', serialize)
+
+    def test_list_serialization(self):
+        transactions = [
+            Transaction(id=i, customer_id=f"cust-{i}", input_amount=Decimal('10.00'), input_currency='USD',
+                        output_amount=Decimal('1292.50'), output_currency='KES')
+            for i in range(50)
+        ]
+        self.number = 20
+        self.measure('list_serialization_50', lambda: TransactionSerializer(transactions, many=True).data)
+
+
+class ProfilingMiddlewareTests(EndpointBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        overrides = self.settings(PROFILE_HEADER_TOKEN='profile-secret', PROFILE_SAMPLE_RATE=0,
+                                  PROFILE_DIR=self.profile_dir.name, PROFILE_MAX_FILES=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_disabled_without_token_or_sample_rate(self):
+        with self.settings(PROFILE_HEADER_TOKEN=None, PROFILE_SAMPLE_RATE=0):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: None)
+
+    def test_untriggered_request_is_not_profiled(self):
+        response = self.client.get(reverse('list_transactions'))
+        self.assertNotIn('X-Profile-Id', response)
+        response = self.client.get(reverse('list_transactions'), HTTP_X_FXVAULT_PROFILE='wrong')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_profiles(), [])
+
+    def test_non_ascii_header_is_not_profiled(self):
+        response = self.client.get(reverse('list_transactions'), HTTP_X_FXVAULT_PROFILE='sécret')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_profiles(), [])
+
+    def test_authorized_header_writes_profile(self):
+        response = self.create_transaction_profiled()
+        profile_id = response['X-Profile-Id']
+        profile, = list_profiles()
+        self.assertEqual(profile['id'], profile_id)
+        self.assertEqual(profile['path'], reverse('create_transaction'))
+        self.assertEqual(profile['status'], 201)
+        self.assertEqual(len(profile['queries']), 2)
+        self.assertGreater(profile['peak_memory'], 0)
+        self.assertTrue(Path(self.profile_dir.name, f"{profile_id}.prof").exists())
+
+    def test_sampled_request_is_profiled(self):
+        with self.settings(PROFILE_HEADER_TOKEN=None, PROFILE_SAMPLE_RATE=1.0):
+            response = self.client.get(reverse('list_transactions'))
+        self.assertIn('X-Profile-Id', response)
+
+    def test_profiles_are_rotated(self):
+        for _ in range(3):
+            self.create_transaction_profiled()
+        self.assertEqual(len(list_profiles()), 2)
+        self.assertEqual(len(list(Path(self.profile_dir.name).glob('*.prof'))), 2)
+
+    def test_profiles_command(self):
+        profile_id = self.create_transaction_profiled()['X-Profile-Id']
+        out = StringIO()
+        call_command('profiles', stdout=out)
+        self.assertIn(profile_id, out.getvalue())
+
+        out = StringIO()
+        call_command('profiles', profile_id, stdout=out)
+        self.assertIn("SQL queries: 2", out.getvalue())
+        self.assertIn("function calls", out.getvalue())
+
+    def test_profiles_command_missing_call_profile(self):
+        profile_id = self.create_transaction_profiled()['X-Profile-Id']
+        Path(self.profile_dir.name, f"{profile_id}.prof").unlink()
+        with self.assertRaisesMessage(CommandError, "could not be read"):
+            call_command('profiles', profile_id, stdout=StringIO())
+
+    def test_profiles_command_invalid_sort_key(self):
+        profile_id = self.create_transaction_profiled()['X-Profile-Id']
+        with self.assertRaisesMessage(CommandError, "Invalid sort key 'bogus'"):
+            call_command('profiles', profile_id, sort='bogus', stdout=StringIO())
+
+    def test_profiles_command_skips_malformed_metadata(self):
+        profile_id = self.create_transaction_profiled()['X-Profile-Id']
+        Path(self.profile_dir.name, "99999999T000000000000-broken.json").write_text('{"path": "/api/"}')
+        out, err = StringIO(), StringIO()
+        call_command('profiles', stdout=out, stderr=err)
+        self.assertIn(profile_id, out.getvalue())
+        self.assertIn("Skipping malformed profile", err.getvalue())
+
+    def create_transaction_profiled(self):
+        self.client.credentials(HTTP_X_FXVAULT_PROFILE='profile-secret')
+        try:
+            return self.create_transaction()
+        finally:
+            self.client.credentials()
+
+
+class ThrottlingTests(EndpointBudgetTestCase):
+
+    def deny(self, scope, wait=2.5):
+        def consume(throttle, key):
+            return (False, wait) if throttle.scope == scope else (True, None)
+        self.consume.side_effect = consume
+
+    def test_request_bucket_is_per_user(self):
+        self.client.get(reverse('list_transactions'))
+        self.assertEqual(self.consumed('fxvault_requests'), [f"throttle_bucket_fxvault_requests_{self.user.pk}"])
+
+    def test_request_rate_exceeded_sets_retry_after(self):
+        self.deny('fxvault_requests')
+        response = self.client.get(reverse('list_transactions'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_currencies_consume_upstream_token(self):
+        self.client.get(reverse('currency-list'))
+        self.assertEqual(len(self.consumed('fxvault_upstream')), 1)
+
+        self.deny('fxvault_upstream')
+        response = self.client.get(reverse('currency-list'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(self.provider.calls), 1)
+
+    def test_create_consumes_upstream_token_only_on_cold_cache(self):
+        self.create_transaction()
+        self.create_transaction()
+        self.assertEqual(len(self.consumed('fxvault_upstream')), 1)
+
+    def test_create_upstream_exceeded_returns_429(self):
+        self.deny('fxvault_upstream', wait=10)
+        response = self.create_transaction()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+        self.assertEqual(self.provider.calls, [])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_anonymous_bucket_ignores_forwarded_for(self):
+        anonymous = APIClient()
+        for forwarded_for in ('203.0.113.1', '203.0.113.2', '198.51.100.7'):
+            anonymous.get(reverse('currency-list'), HTTP_X_FORWARDED_FOR=forwarded_for, REMOTE_ADDR='192.0.2.10')
+        self.assertEqual(self.consumed('fxvault_upstream'), ['throttle_bucket_fxvault_upstream_192.0.2.10'] * 3)
+
+    def test_redis_unavailable_allows_request(self):
+        self.consume_patcher.stop()
+        bucket = mock.patch('FXVault.throttling.get_token_bucket', side_effect=RedisError("Connection refused"))
+        with bucket as get_token_bucket, mock.patch('FXVault.throttling._redis_down_until', 0.0), \
+                self.assertLogs('FXVault', level='WARNING') as logs:
+            throttle = UserRequestRateThrottle()
+            self.assertEqual(throttle.consume('throttle_bucket_test'), (True, None))
+            # Redis is not retried, and the warning not repeated, until the retry interval passes
+            self.assertEqual(throttle.consume('throttle_bucket_test'), (True, None))
+        self.assertEqual(get_token_bucket.call_count, 1)
+        self.assertEqual(len(logs.records), 1)
+
+
+class RedisTokenBucketTests(SimpleTestCase):
+    """Runs the token bucket script against THROTTLE_REDIS_URL; skipped when Redis is unreachable."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Build a fresh script client for this class and drop it afterwards
+        for name in ('_token_bucket', '_redis_down_until'):
+            patcher = mock.patch.object(throttling, name, None if name == '_token_bucket' else 0.0)
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+        try:
+            cls.redis = throttling.get_token_bucket().registered_client
+            cls.redis.ping()
+        except RedisError as e:
+            raise unittest.SkipTest(f"Redis unavailable at {settings.THROTTLE_REDIS_URL}: {e}")
+
+    def setUp(self):
+        self.user = mock.Mock(is_authenticated=True, pk=f"test-{uuid.uuid4().hex}")
+        self.request = mock.Mock(user=self.user)
+        self.addCleanup(self.clear_buckets)
+
+    def clear_buckets(self):
+        keys = list(self.redis.scan_iter(f"throttle_bucket_*_{self.user.pk}"))
+        if keys:
+            self.redis.delete(*keys)
+
+    def throttle(self, rate, throttle_class=UserRequestRateThrottle):
+        return type(throttle_class.__name__, (throttle_class,), {'rate': rate})()
+
+    def test_burst_capacity_then_denied(self):
+        throttle = self.throttle('5/min')
+        for _ in range(5):
+            self.assertTrue(throttle.allow_request(self.request, None))
+        self.assertFalse(throttle.allow_request(self.request, None))
+        # one token refills every 60 / 5 seconds
+        self.assertAlmostEqual(throttle.wait(), 12, delta=0.1)
+
+    def test_tokens_refill_over_time(self):
+        throttle = self.throttle('10/s')
+        for _ in range(10):
+            self.assertTrue(throttle.allow_request(self.request, None))
+        self.assertFalse(throttle.allow_request(self.request, None))
+        time.sleep(0.25)
+        self.assertTrue(throttle.allow_request(self.request, None))
+        self.assertTrue(throttle.allow_request(self.request, None))
+
+    def test_key_ttl_is_rate_duration(self):
+        throttle = self.throttle('5/min')
+        throttle.allow_request(self.request, None)
+        ttl = self.redis.pttl(throttle.get_cache_key(self.request, None))
+        self.assertGreater(ttl, 59000)
+        self.assertLessEqual(ttl, 60000)
+
+    def test_request_and_upstream_buckets_are_separate(self):
+        requests_throttle = self.throttle('2/min')
+        upstream_throttle = self.throttle('2/min', UpstreamFetchThrottle)
+        self.assertNotEqual(requests_throttle.get_cache_key(self.request, None),
+                            upstream_throttle.get_cache_key(self.request, None))
+        for _ in range(2):
+            upstream_throttle.allow_request(self.request, None)
+        self.assertFalse(upstream_throttle.allow_request(self.request, None))
+        self.assertTrue(requests_throttle.allow_request(self.request, None))
+
+    def test_check_is_single_round_trip(self):
+        throttle = self.throttle('5/min')
+        key = throttle.get_cache_key(self.request, None)
+        throttle.consume(key)  # loads the script on first use
+        with mock.patch.object(self.redis, 'execute_command', wraps=self.redis.execute_command) as execute:
+            throttle.consume(key)
+        self.assertEqual([call.args[0] for call in execute.call_args_list], ['EVALSHA'])
+
+    @unittest.skipUnless(RUN_BENCHMARKS, "Set FXVAULT_BENCHMARKS=1 to run the micro-benchmarks")
+    def test_check_overhead_is_sub_millisecond(self):
+        throttle = self.throttle('1000000/s')
+        key = throttle.get_cache_key(self.request, None)
+        throttle.consume(key)  # warm up the connection and script cache
+        number = 500
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(number):
+                throttle.consume(key)
+            best = min(best, (time.perf_counter() - start) / number)
+        self.assertLess(best, 0.001, f"Throttle check took {best * 1e6:.1f}us")
@@ -0,0 +1,104 @@
+import logging
+import time
+
+import redis
+from django.conf import settings
+from redis.exceptions import RedisError
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = logging.getLogger('FXVault')
+
+# Refills the bucket for the time elapsed since the last check and takes one token, all in a
+# single round trip. Returns {allowed, seconds to wait for the next token}.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * refill_rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / refill_rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill_rate * 1000))
+return {allowed, tostring(wait)}
+"""
+
+_token_bucket = None
+# While Redis is failing, checks are skipped until this monotonic time instead of paying a timeout each
+_redis_down_until = 0.0
+
+
+def get_token_bucket():
+    global _token_bucket
+    if _token_bucket is None:
+        # A dedicated client with tight timeouts, so an unreachable Redis fails fast and the request goes on
+        client = redis.Redis.from_url(
+            settings.THROTTLE_REDIS_URL,
+            socket_connect_timeout=settings.THROTTLE_REDIS_SOCKET_TIMEOUT,
+            socket_timeout=settings.THROTTLE_REDIS_SOCKET_TIMEOUT,
+        )
+        # register_script runs through EVALSHA and only sends the script body on NOSCRIPT
+        _token_bucket = client.register_script(TOKEN_BUCKET_SCRIPT)
+    return _token_bucket
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Per-user token bucket kept in Redis. The rate for `scope` in DEFAULT_THROTTLE_RATES
+    ("120/min") sets both the burst capacity and the refill rate. Anonymous requests are
+    bucketed by client IP. If Redis is unavailable requests are let through, and Redis is
+    not retried for THROTTLE_REDIS_RETRY_INTERVAL seconds.
+    """
+    cache_format = 'throttle_bucket_%(scope)s_%(ident)s'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        if self.rate is None:
+            return True
+        allowed, self.wait_seconds = self.consume(self.get_cache_key(request, view))
+        return allowed
+
+    def consume(self, key):
+        global _redis_down_until
+        if time.monotonic() < _redis_down_until:
+            return True, None
+        try:
+            allowed, wait = get_token_bucket()(keys=[key], args=[self.num_requests,
+                                                                 self.num_requests / self.duration])
+        except RedisError as e:
+            _redis_down_until = time.monotonic() + settings.THROTTLE_REDIS_RETRY_INTERVAL
+            logger.warning("Redis unavailable, skipping throttle checks for %s seconds: %s",
+                           settings.THROTTLE_REDIS_RETRY_INTERVAL, str(e))
+            return True, None
+        return bool(allowed), float(wait)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserRequestRateThrottle(TokenBucketThrottle):
+    scope = 'fxvault_requests'
+
+
+class UpstreamFetchThrottle(TokenBucketThrottle):
+    """Limits the exchange rate API calls a single user can trigger."""
+    scope = 'fxvault_upstream'
@@ -3,6 +3,7 @@ import requests
 import time  # Import the time module for measuring time
 from decimal import Decimal
 from rest_framework import status
+from rest_framework.exceptions import Throttled
 from rest_framework.response import Response
 from rest_framework import generics
 from django.conf import settings
@@ -10,6 +11,7 @@ from django.core.cache import cache
 from rest_framework.permissions import IsAuthenticated
 from .models import Transaction, UserCurrencyPreference
 from .serializers import TransactionSerializer, ExchangeRateSerializer, UserCurrencyPreferenceSerializer
+from .throttling import UserRequestRateThrottle, UpstreamFetchThrottle
 
 # Initialize logger for FXVault app
 logger = logging.getLogger('FXVault')
@@ -20,10 +22,33 @@ logger.info("This is an info message")
 logger.error("This is an error message")
 
 
+def build_transaction_serializer(validated_data, exchange_rate):
+    """Convert a validated ExchangeRateSerializer payload at `exchange_rate` into an unsaved transaction."""
+    input_amount = Decimal(str(validated_data['input_amount']))
+    output_amount = round(exchange_rate * input_amount, 2)
+
+    transaction_data = {
+        "input_amount": input_amount,
+        "input_currency": validated_data['input_currency'],
+        "output_currency": validated_data['output_currency'],
+        "output_amount": output_amount,
+        "customer_id": validated_data['customer_id']
+    }
+    return TransactionSerializer(data=transaction_data)
+
+
 class TransactionCreateView(generics.CreateAPIView):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [UserRequestRateThrottle]
+
+    def check_upstream_throttle(self, request):
+        # Only cache misses reach the exchange rate API, so the upstream bucket is checked here
+        throttle = UpstreamFetchThrottle()
+        if not throttle.allow_request(request, self):
+            logger.warning("User %s exceeded the upstream fetch rate", request.user.username)
+            self.throttled(request, throttle.wait())
 
     def create(self, request, *args, **kwargs):
         logger.debug("TransactionCreateView.create called with data: %s", request.data)
@@ -60,6 +85,7 @@ class TransactionCreateView(generics.CreateAPIView):
                                 output_currency, elapsed_time)
                     exchange_rate = Decimal(str(exchange_rate))
                 else:
+                    self.check_upstream_throttle(request)
                     api_url = f"{settings.EXCHANGE_RATE_API_URL}/{settings.EXCHANGE_RATE_API_KEY}/latest/USD"
                     response = requests.get(api_url, verify=False)
 
@@ -75,17 +101,8 @@ class TransactionCreateView(generics.CreateAPIView):
                                 "Fetched exchange rate from external API for %s to %s. Time taken: %.4f seconds",
                                 input_currency, output_currency, elapsed_time)
 
-                            input_amount = Decimal(str(exchange_rate_serializer.validated_data['input_amount']))
-                            output_amount = round(exchange_rate * input_amount, 2)
-
-                            transaction_data = {
-                                "input_amount": input_amount,
-                                "input_currency": input_currency,
-                                "output_currency": output_currency,
-                                "output_amount": output_amount,
-                                "customer_id": exchange_rate_serializer.validated_data['customer_id']
-                            }
-                            transaction_serializer = TransactionSerializer(data=transaction_data)
+                            transaction_serializer = build_transaction_serializer(
+                                exchange_rate_serializer.validated_data, exchange_rate)
                             if transaction_serializer.is_valid():
                                 transaction_serializer.save()
                                 logger.info("Transaction created successfully for user %s", user.username)
@@ -101,17 +118,8 @@ class TransactionCreateView(generics.CreateAPIView):
                     }, status=status.HTTP_502_BAD_GATEWAY)
 
                 # Process transaction using cached rate
-                input_amount = Decimal(str(exchange_rate_serializer.validated_data['input_amount']))
-                output_amount = round(exchange_rate * input_amount, 2)
-
-                transaction_data = {
-                    "input_amount": input_amount,
-                    "input_currency": input_currency,
-                    "output_currency": output_currency,
-                    "output_amount": output_amount,
-                    "customer_id": exchange_rate_serializer.validated_data['customer_id']
-                }
-                transaction_serializer = TransactionSerializer(data=transaction_data)
+                transaction_serializer = build_transaction_serializer(
+                    exchange_rate_serializer.validated_data, exchange_rate)
                 if transaction_serializer.is_valid():
                     transaction_serializer.save()
                     logger.info("Transaction created successfully for user %s using cached rate", user.username)
@@ -134,6 +142,8 @@ class TransactionCreateView(generics.CreateAPIView):
                 "message": "Currency preferences not found for this user.",
                 "status": status.HTTP_404_NOT_FOUND
             }, status=status.HTTP_404_NOT_FOUND)
+        except Throttled:
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred during transaction creation: %s", str(e))
             return Response({
@@ -146,6 +156,8 @@ class UserCurrencyPreferenceView(generics.GenericAPIView):
     queryset = UserCurrencyPreference.objects.all()
     serializer_class = UserCurrencyPreferenceSerializer
     permission_classes = [IsAuthenticated]
+    # Preference validation fetches the available currencies upstream
+    throttle_classes = [UserRequestRateThrottle, UpstreamFetchThrottle]
 
     def post(self, request, *args, **kwargs):
         logger.debug("UserCurrencyPreferenceView.post called with data: %s", request.data)
@@ -204,6 +216,8 @@ class UserCurrencyPreferenceView(generics.GenericAPIView):
 
 
 class CurrencyListView(generics.ListAPIView):
+    throttle_classes = [UserRequestRateThrottle, UpstreamFetchThrottle]
+
     def get_queryset(self):
         logger.debug("CurrencyListView.get_queryset called")
         api_url = f"{settings.EXCHANGE_RATE_API_URL}/{settings.EXCHANGE_RATE_API_KEY}/latest/USD"
@@ -233,6 +247,7 @@ class CurrencyListView(generics.ListAPIView):
 class TransactionListView(generics.ListAPIView):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    throttle_classes = [UserRequestRateThrottle]
 
     def list(self, request, *args, **kwargs):
         logger.debug("TransactionListView.list called")
@@ -248,6 +263,7 @@ class TransactionDetailView(generics.RetrieveAPIView):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     lookup_field = 'identifier'
+    throttle_classes = [UserRequestRateThrottle]
 
     def retrieve(self, request, *args, **kwargs):
         logger.debug("TransactionDetailView.retrieve called with identifier: %s", kwargs.get('identifier'))
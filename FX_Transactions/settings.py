@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'FXVault.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -93,6 +94,15 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
+    # Token bucket rates for FXVault.throttling, kept in Redis at THROTTLE_REDIS_URL
+    'DEFAULT_THROTTLE_RATES': {
+        'fxvault_requests': config('THROTTLE_REQUEST_RATE', default='120/min'),
+        'fxvault_upstream': config('THROTTLE_UPSTREAM_RATE', default='10/min'),
+    },
+    # Reverse proxies in front of the app. Anonymous callers are throttled by client IP, and
+    # X-Forwarded-For is only trusted this many hops deep; 0 uses REMOTE_ADDR so clients
+    # cannot pick their own bucket by rotating the header.
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
 
@@ -140,6 +150,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 EXCHANGE_RATE_API_URL = os.getenv('EXCHANGE_RATE_API_URL')
 EXCHANGE_RATE_API_KEY = os.getenv('EXCHANGE_RATE_API_KEY')
 
+# Opt-in request profiling: send the X-FXVault-Profile header with this token,
+# or sample a fraction of requests. Profiling is disabled when neither is set.
+PROFILE_HEADER_TOKEN = os.getenv('PROFILE_HEADER_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', BASE_DIR / 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 100))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.getenv('ACCESS_TOKEN_LIFETIME', 50))),
     'REFRESH_TOKEN_LIFETIME': timedelta(minutes=int(os.getenv('REFRESH_TOKEN_LIFETIME', 180)))
@@ -159,6 +176,12 @@ CACHES = {
     }
 }
 
+# Redis for the FXVault.throttling token buckets. Timeouts are kept tight because every
+# throttled request makes a call here; on failure checks are skipped for the retry interval.
+THROTTLE_REDIS_URL = config('THROTTLE_REDIS_URL', default=CACHES['default']['LOCATION'])
+THROTTLE_REDIS_SOCKET_TIMEOUT = config('THROTTLE_REDIS_SOCKET_TIMEOUT', default=0.05, cast=float)
+THROTTLE_REDIS_RETRY_INTERVAL = config('THROTTLE_REDIS_RETRY_INTERVAL', default=5, cast=int)
+
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 